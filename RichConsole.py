@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-__all__ = ("ControlCodes", "Style", "Color", "BasicColor", "IndexedColor", "RGBColor", "StyleGroup", "groups", "Sheet", "RichStr", "rsjoin", "neutral", "neutralGroup", "neutralSheet")
+__all__ = ("ControlCodes", "Style", "Color", "BasicColor", "IndexedColor", "RGBColor", "StyleGroup", "GroupsStorage", "groups", "updateGroupResets", "Sheet", "RichStr", "rsjoin", "neutral", "neutralGroup", "neutralSheet")
 __author__ = "KOLANICH"
 __license__ = "Unlicense"
 __copyright__ = r"""
@@ -18,8 +18,8 @@ For more information, please refer to <https://unlicense.org/>
 
 import sys
 import typing
-import itertools, re
-from codecs import encode
+import itertools, re, weakref
+import functools
 from collections.abc import MutableMapping
 
 try:
@@ -34,23 +34,62 @@ except BaseException:  # pylint: disable=broad-except
 
 
 class ControlCodes:
-	"""Represents a sequence of control codes"""
+	"""Represents a sequence of control codes. Instances of this very class (not of its subclasses) are interned by their codes, so treat them as immutable"""
+
+	_pool = weakref.WeakValueDictionary()
+	_interned = False
+
+	def __new__(cls, *args, **kwargs):
+		if cls is not __class__ or not args:
+			return super().__new__(cls)
+
+		codes = args[0]
+		if not isinstance(codes, tuple):
+			codes = (codes,)
+		self = cls._pool.get(codes)
+		if self is None:
+			self = super().__new__(cls)
+			self.codes = codes
+			self._interned = True
+			cls._pool[codes] = self
+		return self
 
 	def __init__(self, codes: ContainerTuple[int]) -> ContainerTuple[int]:
+		if self._interned:  # already initialized in __new__
+			return
 		if not isinstance(codes, tuple):
 			codes = (codes,)
 		self.codes = codes
 
+	@property
+	def codes(self) -> ContainerTuple[int]:
+		return self._codes
+
+	@codes.setter
+	def codes(self, codes: ContainerTuple[int]) -> None:
+		if self._interned:
+			raise AttributeError("Interned " + self.__class__.__name__ + " are immutable, create a new one instead")
+		initialized = "_codes" in self.__dict__
+		self._codes = codes
+		self._rendered = None  # the escape sequence is rendered lazily in __str__
+		if initialized:
+			_stylesChanged()
+
 	def __str__(self) -> str:
-		if self.codes:
-			return "".join(("\x1b[", ";".join(map(str, self.codes)), "m"))
-		return ""
+		res = self._rendered
+		if res is None:
+			if self._codes:
+				res = "".join(("\x1b[", ";".join(map(str, self._codes)), "m"))
+			else:
+				res = ""
+			self._rendered = res
+		return res
 
 	def __repr__(self):
 		return "".join((self.__class__.__name__, "(", repr(self.codes), ")"))
 
 	def __eq__(self, other: "ControlCodes") -> bool:
-		return self.codes == other.codes
+		return self is other or self.codes == other.codes
 
 	def __hash__(self):
 		return hash(self.codes)
@@ -75,7 +114,10 @@ class Style(ControlCodes):
 		return {}
 
 	def __repr__(self):
-		return "".join([str(self), ((self.group.name + ":") if (self.group and self.group.name) else ""), (self.name if self.name else repr(self.name)), (str(self.group.reset) if self.group and self.group.reset else "\x1b[0m")])
+		group = self.group
+		groupPrefix = (group.name + ":") if (group and group.name) else ""
+		resetCode = group.reset if group and group.reset else "\x1b[0m"
+		return f"{self}{groupPrefix}{self.name or repr(self.name)}{resetCode}"
 
 	def __add__(self, other: "Style") -> typing.Union["Style", ControlCodes]:
 		if self.group is other.group:
@@ -148,100 +190,67 @@ class StyleGroup(Storage):
 		return str(self.values())
 
 	def __repr__(self):
-		return "".join((
-			self.__class__.__name__, "(",
-			", ".join((repr(self.name), repr(tuple((v for v in self.values() if isinstance(v, Style)))), "reset=" + repr(self.reset))),
-			")"
-		))
+		styles = tuple(v for v in self.values() if isinstance(v, Style))
+		return f"{self.__class__.__name__}({self.name!r}, {styles!r}, reset={self.reset!r})"
+
+
+class GroupsStorage(Storage):
+	"""A storage of (StyleGroup)s. When it is the global ```groups```, adding, replacing or removing a group, via both . and [] notation, rebuilds the lookup table of reset styles used for rendering (see updateGroupResets)"""
+
+	def __setitem__(self, key: str, val: StyleGroup) -> None:
+		super().__setitem__(key, val)
+		if self is groups:
+			updateGroupResets()
+
+	def __delitem__(self, key: str):
+		super().__delitem__(key)
+		if self is groups:
+			updateGroupResets()
+
+	def __setattr__(self, key: str, val: typing.Any) -> None:
+		super().__setattr__(key, val)
+		if key != "__dict__" and self is groups:
+			updateGroupResets()
+
+	def __delattr__(self, key: str) -> None:
+		super().__delattr__(key)
+		if self is groups:
+			updateGroupResets()
 
 
 reset = Style("reset", (0,))  # pylint: disable=unused-variable
 # groups:typing.Optional[Storage]=None
 
-"""This is our global storage of styles"""
-groups = Storage(
-	{
-		"Back": StyleGroup("Back", [], Style("reset", (49,))),
-		"Fore": StyleGroup("Fore", [], Style("reset", (39,))),
-		"Brightness": StyleGroup(
-			"Brightness",
-			[
-				Style("bright", (1,)),
-				Style("dim", (2,)),
-			],
-			Style("reset", (21,)),
-		),
-		"Decor": StyleGroup(
-			"Decor",
-			[
-				Style("italic", (3,)),
-				Style("fraktur", (20,)),
-			],
-			Style("reset", (23,)),
-		),
-		"Underline": StyleGroup(
-			"Underline",
-			[
-				Style("underline", (4,)),
-			],
-			Style("reset", (24,)),
-		),
-		"CrossedOut": StyleGroup(
-			"CrossedOut",
-			[
-				Style("crossedOut", (9,)),
-			],
-			Style("reset", (29,)),
-		),
-		"Conceal": StyleGroup(
-			"Conceal",
-			[
-				Style("conceal", (8,)),
-			],
-			Style("reset", (28,)),
-		),
-		"Blink": StyleGroup(
-			"Blink",
-			[
-				Style("slow", (5,)),
-				Style("rapid", (6,)),
-			],
-			Style("reset", (25,)),
-		),
-		"Frame": StyleGroup(
-			"Frame",
-			[
-				Style("framed", (51,)),
-				Style("encircled", (52,)),
-			],
-			Style("reset", (54,)),
-		),
-		"Overline": StyleGroup(
-			"Overline",
-			[
-				Style("overlined", (53,)),
-			],
-			Style("reset", (55,)),
-		),
-		"Ideogram": StyleGroup(
-			"Ideogram",
-			[
-				Style("singleUnderOrRight", (60,)),
-				Style("doubleUpperOrRight", (61,)),
-				Style("singleOverOrLeft", (62,)),
-				Style("doubleOverOrLeft", (63,)),
-				Style("stress", (64,)),
-			],
-			Style("reset", (65,)),
-		),
-		"Font": StyleGroup("Font", [Style("f" + str(i), (11 + i,)) for i in range(9)], Style("reset", (10,))),
-	}
+_groupsSpec = (  # (group name, reset code, ((style name, code), ...))
+	("Back", 49, ()),
+	("Fore", 39, ()),
+	("Brightness", 21, (("bright", 1), ("dim", 2))),
+	("Decor", 23, (("italic", 3), ("fraktur", 20))),
+	("Underline", 24, (("underline", 4),)),
+	("CrossedOut", 29, (("crossedOut", 9),)),
+	("Conceal", 28, (("conceal", 8),)),
+	("Blink", 25, (("slow", 5), ("rapid", 6))),
+	("Frame", 54, (("framed", 51), ("encircled", 52))),
+	("Overline", 55, (("overlined", 53),)),
+	("Ideogram", 65, (("singleUnderOrRight", 60), ("doubleUpperOrRight", 61), ("singleOverOrLeft", 62), ("doubleOverOrLeft", 63), ("stress", 64))),
+	("Font", 10, tuple(("f" + str(i), 11 + i) for i in range(9))),
 )
 
 
+def _buildGroups(spec: typing.Iterable[typing.Tuple[str, int, typing.Iterable[typing.Tuple[str, int]]]]) -> GroupsStorage:
+	"""Builds a storage of (StyleGroup)s of single-code (Style)s from a spec like _groupsSpec"""
+	res = {}
+	for groupName, resetCode, styles in spec:
+		res[groupName] = StyleGroup(groupName, [Style(name, (code,)) for name, code in styles], Style("reset", (resetCode,)))
+	return GroupsStorage(res)
+
+
+"""This is our global storage of styles"""
+groups = _buildGroups(_groupsSpec)
+
+
 def tupleReplace(tup: ContainerTuple[int], pos: int, new: int) -> ContainerTuple[int]:  # in fact tuple of ints of any length, but python.typing doesn't have means out of the box to express this
-	prev = max((pos - 1, 0))
-	return tup[0:prev] + (new,) + tup[(pos + 1) :]
+	return tup[:pos] + (new,) + tup[(pos + 1) :]
 
 
 class Color(Style):
@@ -257,6 +266,11 @@ class Color(Style):
 	def __init__(self, name: typing.Optional[str], codes: typing.Tuple[int]) -> None:
 		super().__init__(name, codes)
 
+	@classmethod
+	def composeCode(cls, basicIndex: int, bg: bool = False) -> int:
+		"""Computes the main control code of a color arithmetically, without going through the property setters"""
+		return cls.controlCodesColorRangeOffset + basicIndex + (cls.backgroundOffset if bg else 0)
+
 	@property
 	def code(self):
 		"""A main (with index zero) control code of the color
@@ -282,14 +296,20 @@ class Color(Style):
 		prev = getattr(self, name)
 		self.code += (int(bool(val)) - int(prev)) * magic
 
+	def _shiftCode(self, delta: int) -> None:
+		"""Adds delta to the main code. The codes are replaced (and their rendering is invalidated) only if they really change"""
+		if delta:
+			codes = self.codes
+			self.codes = (codes[0] + delta,) + codes[1:]
+
 	@property
 	def bg(self):
 		"""Is the color applied to background?"""
-		return self.basicIndex >= self.backgroundOffset
+		return self.codes[0] % self.offset_intensiveOffset_GCD >= self.backgroundOffset
 
 	@bg.setter
 	def bg(self, bg: bool):
-		self.setNumeric("bg", bg, self.backgroundOffset)
+		self._shiftCode((bool(bg) - self.bg) * self.backgroundOffset)
 
 	@property
 	def group(self):
@@ -330,11 +350,11 @@ class _BasicColor(Color):
 	@property
 	def intensive(self):
 		"""Is the color intensive?"""
-		return self.code >= (self.intensiveOffset + self.controlCodesColorRangeOffset)
+		return self.codes[0] >= (self.intensiveOffset + self.controlCodesColorRangeOffset)
 
 	@intensive.setter
 	def intensive(self, val: bool):
-		self.setNumeric("intensive", val, self.intensiveOffset)
+		self._shiftCode((bool(val) - self.intensive) * self.intensiveOffset)
 
 	def toRGB(self):
 		res = [None] * 3
@@ -351,10 +371,7 @@ class _BasicColor(Color):
 
 class BasicColor(_BasicColor):
 	def __init__(self, name, basicIndex, intensive=False, bg=False):
-		super().__init__(self.controlCodesColorRangeOffset, name)
-		self.basicIndex = basicIndex
-		self.bg = bg
-		self.intensive = intensive
+		super().__init__(self.composeCode(basicIndex, bg) + (self.intensiveOffset if intensive else 0), name)
 
 	@staticmethod
 	def parse(name: str, code: int) -> "BasicColor":
@@ -366,9 +383,9 @@ class BasicColor(_BasicColor):
 class EnchancedColor(Color):
 	"""Any color using enchancedColorBasicIndex as its basic index and extended with the other codes in a sequence"""
 
-	def __init__(self, name: typing.Optional[str], codes: ContainerTuple[int]) -> None:
-		super().__init__(name, codes)
-		self.basicIndex = self.enchancedColorBasicIndex
+	def __init__(self, name: typing.Optional[str], codes: ContainerTuple[int], bg: bool = False) -> None:
+		"""The main code (```codes[0]```) is replaced with the one computed from enchancedColorBasicIndex and bg"""
+		super().__init__(name, (self.composeCode(self.enchancedColorBasicIndex, bg),) + tuple(codes[1:]))
 
 	@property
 	def typeIndex(self):
@@ -384,8 +401,7 @@ class IndexedColor(EnchancedColor):
 
 	def __init__(self, name: typing.Optional[str], index: int, bg: bool = False) -> None:
 		assert 0 <= index <= 255
-		super().__init__(name, (self.controlCodesColorRangeOffset, 5, index))
-		self.bg = bg
+		super().__init__(name, (self.controlCodesColorRangeOffset, 5, index), bg)
 
 	@property
 	def index(self):
@@ -398,7 +414,7 @@ class IndexedColor(EnchancedColor):
 
 def RGB2CSSHex(r: int, g: int, b: int):
 	"""Converts an rgb triple into a CSS hex color representation"""
-	return "#" + str(encode(bytes((r, g, b)), "hex"), encoding="ascii")
+	return "#" + bytes((r, g, b)).hex()
 
 
 class RGBColor(EnchancedColor):
@@ -407,9 +423,7 @@ class RGBColor(EnchancedColor):
 	def __init__(self, name: typing.Optional[str], r: int = 0, g: int = 0, b: int = 0, bg: bool = False) -> None:
 		if name is None:
 			name = RGB2CSSHex(r, g, b)
-		super().__init__(name, (self.controlCodesColorRangeOffset, 2, r, g, b))
-		self.bg = bg
-		# print(self)
+		super().__init__(name, (self.controlCodesColorRangeOffset, 2, r, g, b), bg)
 
 	@property
 	def r(self):
@@ -442,19 +456,46 @@ class RGBColor(EnchancedColor):
 		return RGB2CSSHex(self.r, self.g, self.b)
 
 
-under_score2camelCaseRx = re.compile(r"""_(\w)""")
+def under_score2camelCase(s: str) -> str:
+	s = s.lower()
+	if "_" not in s:
+		return s
+	parts = s.split("_")
+	return parts[0] + "".join(p[:1].upper() + p[1:] for p in parts[1:])
 
 
-def under_score2camelCase(s: str) -> str:
-	i = 0
-	res = []
-	for token in under_score2camelCaseRx.split(s):
-		if i % 2 == 1:
-			res.append(token.upper())
-		else:
-			res.append(token.lower())
-		i += 1
-	return "".join(res)
+_groupResets = ()  # (groupName, resetStyle) pairs in the order of groups, precomputed for Sheet.diff
+
+
+@functools.lru_cache(maxsize=1024)
+def _renderFrozenTransition(prev: "_FrozenSheet", cur: "_FrozenSheet", merge: bool) -> str:
+	"""Memoized renderTransition for interned states, ```merge``` is passed to transitionCodes. Depends on _groupResets and on the codes of the styles, so it is cleared by _stylesChanged."""
+	return "".join(map(str, transitionCodes(prev.styles, cur.styles, merge)))
+
+
+_generation = 0  # bumped by every change that can affect the rendering of existing (RichStr)s, validates their cached strings
+
+
+def _treesChanged() -> None:
+	"""Must be called when a (RichStr) or a (Sheet) is modified"""
+	global _generation  # pylint: disable=global-statement
+	_generation += 1
+
+
+def _stylesChanged() -> None:
+	"""Must be called when the codes of an existing style or the reset styles of the groups change"""
+	_renderFrozenTransition.cache_clear()
+	_treesChanged()
+
+
+def updateGroupResets() -> None:
+	"""Rebuilds the lookup table of reset styles of the global ```groups```, used for diffing (Sheet)s and rendering. ```groups``` calls it automatically when groups are added or removed; call it manually after replacing the reset style of an existing group"""
+	global _groupResets  # pylint: disable=global-statement
+	_groupResets = tuple((name, groups[name].reset) for name in groups)
+	_stylesChanged()
+
+
+updateGroupResets()
 
 
 def importGroups(groups: Storage) -> None:  # pylint: disable=redefined-outer-name
@@ -513,36 +554,82 @@ def importGroups(groups: Storage) -> None:  # pylint: disable=redefined-outer-na
 importGroups(groups)
 
 
-class Sheet(Storage):
-	"""Represents the set of string's styles at any moment of time"""
+class Sheet(dict):
+	"""Represents the set of string's styles at any moment of time. It is a dict of (Style)s by names of their groups, also allowing access by . notation"""
 
 	def __init__(self, new: typing.Optional[typing.Union[typing.Union[Style, "Sheet"], typing.List[Style], typing.Mapping[str, Style]]] = {}) -> None:
 		if new is None:
-			for gr in groups:
-				self[gr] = groups[gr].reset
+			super().__init__(_groupResets)
+		elif isinstance(new, Style):
+			super().__init__(((new.group.name, new),))
+		elif isinstance(new, list):
+			super().__init__((n.group.name, n) for n in new)
 		else:
-			if isinstance(new, Sheet):
-				self.__dict__ = type(self.__dict__)(new.__dict__)
-			elif isinstance(new, Style):
-				#print("new is ", new)
-				#print("new group is ", new.group)
-				new = {new.group.name: new}
-			elif isinstance(new, list):
-				new = {n.group.name: n for n in new}
 			super().__init__(new)
 
+	def __getattr__(self, key: str) -> Style:
+		try:
+			return self[key]
+		except KeyError:
+			raise AttributeError(key) from None
+
+	def __setattr__(self, key: str, val: Style) -> None:
+		self[key] = val
+
+	def __delattr__(self, key: str) -> None:
+		try:
+			del self[key]
+		except KeyError:
+			raise AttributeError(key) from None
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + super().__repr__() + ")"
+
+	# the mutating methods invalidate the cached renderings of (RichStr)s
+
+	def __setitem__(self, key: str, val: Style) -> None:
+		super().__setitem__(key, val)
+		_treesChanged()
+
+	def __delitem__(self, key: str) -> None:
+		super().__delitem__(key)
+		_treesChanged()
+
+	def update(self, *args, **kwargs) -> None:  # pylint: disable=arguments-differ
+		super().update(*args, **kwargs)
+		_treesChanged()
+
+	def setdefault(self, key: str, default: typing.Optional[Style] = None) -> Style:
+		res = super().setdefault(key, default)
+		_treesChanged()
+		return res
+
+	def pop(self, *args) -> Style:  # pylint: disable=arguments-differ
+		res = super().pop(*args)
+		_treesChanged()
+		return res
+
+	def popitem(self) -> typing.Tuple[str, Style]:
+		res = super().popitem()
+		_treesChanged()
+		return res
+
+	def clear(self) -> None:
+		super().clear()
+		_treesChanged()
+
 	def diff(self, new: "Sheet") -> "Sheet":
 		old = self
-		patch = Sheet({})
-		for gr in groups:
-			o = old[gr] if gr in old else groups[gr].reset
-			n = new[gr] if gr in new else groups[gr].reset
-			if o == neutral and n == groups[gr].reset:
+		patch = {}
+		for gr, reset in _groupResets:
+			o = old.get(gr, reset)
+			n = new.get(gr, reset)
+			if o == neutral and n == reset:
 				n = neutral
 
 			if o != n:
 				patch[gr] = n
-		return patch
+		return Sheet(patch)
 
 	def __sub__(self, other: "Sheet") -> "Sheet":
 		return other.diff(self)
@@ -551,36 +638,63 @@ class Sheet(Storage):
 		return self | other
 
 	def __or__(self, other: "Sheet") -> "Sheet":
-		tdic = dict(self.__dict__)
-		tdic.update(other.__dict__)
-		return Sheet(tdic)
+		return Sheet({**self, **other})
 
 	def __iadd__(self, other: "Sheet") -> "Sheet":
 		self |= other
 		return self
 
-	def __ior__(self, other: "Sheet"):
-		self.__dict__.update(other.__dict__)
+	def __ior__(self, other: "Sheet") -> "Sheet":
+		self.update(other)
+		return self
 
 	def __call__(self, *strs: typing.Iterable[typing.Union["RichStr", str]]):
 		return RichStr(*strs, sheet=self)
 
 
-def optimizeSheetsToCodes(buf: typing.List[typing.Union[Sheet, str]]) -> typing.Iterator[typing.Union[ControlCodes, str]]:
-	"""Removes unneeded control codes. To do it computes diffs between initial state and final state """
-	initialState = Sheet()
-	state = type(initialState)(initialState)
-	prevState = type(state)(state)
+def changedStyles(prev: typing.Mapping[str, Style], cur: typing.Mapping[str, Style]) -> typing.List[Style]:
+	"""Returns the styles to apply to switch the state ```prev``` into the state ```cur```. The same as ```(Sheet(cur) - Sheet(prev)).values()```, but without creating (Sheet)s"""
+	changed = []
+	for gr, reset in _groupResets:
+		o = prev.get(gr, reset)
+		n = cur.get(gr, reset)
+		if o != n and not (o == neutral and n == reset):
+			changed.append(n)
+	return changed
+
+
+def mergeStyles(styles: typing.List[Style]) -> typing.Optional[ControlCodes]:
+	"""Merges styles into a single Code, the same as summing them up"""
+	if not styles:
+		return None
+	if len(styles) == 1:
+		return styles[0]
+	return ControlCodes(tuple(code for st in styles for code in st.codes))
+
+
+def transitionCodes(prev: typing.Mapping[str, Style], cur: typing.Mapping[str, Style], merge: bool) -> typing.Sequence[ControlCodes]:
+	"""Returns the codes switching the state ```prev``` into the state ```cur```: either a style per changed group or, if ```merge``` is set, a single merged Code"""
+	changed = changedStyles(prev, cur)
+	if merge and changed:
+		return (mergeStyles(changed),)
+	return changed
+
+
+def optimizeSheetsToCodes(buf: typing.List[typing.Union[Sheet, str]], merge: bool = False) -> typing.Iterator[typing.Union[ControlCodes, str]]:
+	"""Removes unneeded control codes. To do it computes diffs between initial state and final state. If ```merge``` is set, each transition is emitted as a single Code. The (Sheet)s in ```buf``` must not be modified while iterating."""
+	initialState = {}
+	state = prevState = initialState
 
 	for it in buf:
 		if isinstance(it, Sheet):
-			state = type(state)(it)
+			state = it
 		else:
-			yield from (state - prevState).values()
-			prevState = type(state)(state)
+			if state is not prevState and state != prevState:
+				yield from transitionCodes(prevState, state, merge)
+				prevState = state
 			yield it
 
-	yield from (initialState - prevState).values()
+	yield from transitionCodes(prevState, initialState, merge)
 
 
 def mergeAdjacentCodes(buf: typing.Iterator[typing.Union[str, ControlCodes]]) -> typing.Iterator[typing.Union[str, ControlCodes]]:
@@ -602,15 +716,61 @@ def mergeAdjacentCodes(buf: typing.Iterator[typing.Union[str, ControlCodes]]) ->
 
 
 mergeCodes = True
+_missing = object()  # a sentinel for keys absent in a dict
+
+
+class _FrozenSheet:
+	"""An immutable snapshot of a state of styles used while rendering. Snapshots are interned, so equal states are represented by the same object"""
+
+	__slots__ = ("styles", "__weakref__")
+	_pool = weakref.WeakValueDictionary()
+
+	def __new__(cls, styles: typing.Mapping[str, Style]) -> "_FrozenSheet":
+		key = frozenset(styles.items())
+		self = cls._pool.get(key)
+		if self is None:
+			self = super().__new__(cls)
+			self.styles = dict(styles)
+			cls._pool[key] = self
+		return self
+
+
+def renderTransition(prev: typing.Mapping[str, Style], cur: typing.Mapping[str, Style]) -> str:
+	"""Returns the control codes switching the state ```prev``` into the state ```cur```. The same as rendering ```Sheet(cur) - Sheet(prev)```, but without creating (Sheet)s"""
+	return "".join(map(str, transitionCodes(prev, cur, mergeCodes)))
 
 
 class RichStr:
-	"""Represents a string with rich formating. Makes a tree of strings and builds a string from that tree in the end"""
+	"""Represents a string with rich formating. Makes a tree of strings and builds a string from that tree in the end.
+	The built string is cached. The cache is invalidated by assigning ```subStrs``` or ```sheet```, by ```+=```, and by any change of a (Sheet) or of the codes of a (Style). In-place modifications of the ```subStrs``` list are not tracked, assign a new list instead. Trees containing leaves other than (str)s are not cached.
+	A (Sheet) passed as ```sheet``` is not copied but shared, so its modifications affect all the (RichStr)s using it."""
 
 	def __init__(self, *args, sheet: typing.Optional[typing.Union[Style, Sheet]] = None) -> None:
-		sheet = Sheet(sheet) if sheet is not None else Sheet()
-		self.subStrs = list(args)
-		self.sheet = sheet
+		if sheet is None:
+			sheet = Sheet.__new__(Sheet)  # an empty dict, no need to run the conversions in __init__
+		elif type(sheet) is not Sheet:  # pylint: disable=unidiomatic-typecheck
+			sheet = Sheet(sheet)
+		self._subStrs = list(args)
+		self._sheet = sheet
+		self._strCache = None  # (_generation, mergeCodes, rendered string)
+
+	@property
+	def subStrs(self) -> typing.List[typing.Union["RichStr", str]]:
+		return self._subStrs
+
+	@subStrs.setter
+	def subStrs(self, subStrs: typing.List[typing.Union["RichStr", str]]) -> None:
+		self._subStrs = subStrs
+		_treesChanged()
+
+	@property
+	def sheet(self) -> Sheet:
+		return self._sheet
+
+	@sheet.setter
+	def sheet(self, sheet: Sheet) -> None:
+		self._sheet = sheet
+		_treesChanged()
 
 	def __add__(self, other: typing.Union["RichStr", str]) -> "RichStr":
 		return __class__(self, other)
@@ -620,20 +780,66 @@ class RichStr:
 
 	def __iadd__(self, other: typing.Union["RichStr", str]) -> "RichStr":
 		if isinstance(other, (str, RichStr)):
-			self.subStrs.append(other)
+			self._subStrs.append(other)
 		elif isinstance(other, list):
-			self.subStrs += other
+			self._subStrs += other
+		_treesChanged()
 		return self
 
+	def _applySheet(self, state: typing.Dict[str, Style]) -> typing.List[typing.Tuple[str, typing.Any]]:
+		"""Overlays own sheet over ```state``` in place. Returns the undo log for ```_revertSheet```"""
+		undo = []
+		for gr, st in self._sheet.items():
+			undo.append((gr, state.get(gr, _missing)))
+			state[gr] = st
+		return undo
+
+	@staticmethod
+	def _revertSheet(state: typing.Dict[str, Style], undo: typing.List[typing.Tuple[str, typing.Any]]) -> None:
+		"""Restores ```state``` modified by ```_applySheet```"""
+		for gr, st in undo:
+			if st is _missing:
+				del state[gr]
+			else:
+				state[gr] = st
+
 	def dfs(self, sheet: Sheet) -> typing.Iterator[typing.Union[Sheet, str]]:
 		"""Transforms the directed acyclic graph of styles into an iterator of styles-applying operations and strings. It's your responsibility to ensure that the graph is acyclic, if it has a cycle you will have infinity recursion."""
-		sheet = Sheet(sheet) + self.sheet
-		for subStr in self.subStrs:
+		return self._dfs(dict(Sheet(sheet)))
+
+	def _dfs(self, state: typing.Dict[str, Style]) -> typing.Iterator[typing.Union[Sheet, str]]:
+		"""Implements dfs using a single ```state``` dict shared by the whole traversal"""
+		undo = self._applySheet(state)
+		sheet = None  # children restore the state when they return, so all the own strings share a single snapshot
+		for subStr in self._subStrs:
 			if isinstance(subStr, RichStr):
-				yield from subStr.dfs(sheet)
+				yield from subStr._dfs(state)  # pylint: disable=protected-access
 			else:
+				if sheet is None:
+					sheet = Sheet(state)
 				yield sheet
 				yield str(subStr)
+		self._revertSheet(state, undo)
+
+	def _render(self, state: typing.Dict[str, Style], prevState: _FrozenSheet, outAppend: typing.Callable[[str], None], volatile: typing.List[typing.Any]) -> _FrozenSheet:
+		"""The fused equivalent of ```optimizedCodeRepr```: walks the tree and passes control codes and strings into ```outAppend```. ```state``` is the scratch state of the traversal, it is updated in place. ```prevState``` is the state of the output, the new one is returned. The leaves which are not (str)s, so can change unnoticed, are appended to ```volatile```."""
+		undo = self._applySheet(state)
+		curState = None  # children restore the state when they return, so all the own strings share a single snapshot
+		for subStr in self._subStrs:
+			if isinstance(subStr, RichStr):
+				prevState = subStr._render(state, prevState, outAppend, volatile)  # pylint: disable=protected-access
+			else:
+				if curState is None:
+					curState = _FrozenSheet(state)
+				if curState is not prevState:
+					outAppend(_renderFrozenTransition(prevState, curState, mergeCodes))
+					prevState = curState
+				if type(subStr) is not str:  # pylint: disable=unidiomatic-typecheck
+					volatile.append(subStr)
+					subStr = str(subStr)
+				outAppend(subStr)
+		self._revertSheet(state, undo)
+		return prevState
 
 	def sheetRepr(self) -> typing.List[typing.Union[Sheet, str]]:
 		"""Returns flat representation of RichString - an array of (Sheet)s and (str)ings"""
@@ -645,13 +851,19 @@ class RichStr:
 
 	def optimizedCodeRepr(self) -> typing.List[typing.Union[str, ControlCodes]]:
 		"""Returns optimized representation of RichString where all the styles are replaced with control codes"""
-		buf = optimizeSheetsToCodes(self.sheetRepr())
-		if mergeCodes:
-			buf = mergeAdjacentCodes(buf)
-		return list(buf)
+		return list(optimizeSheetsToCodes(self.sheetRepr(), mergeCodes))
 
 	def plain(self) -> str:
-		return "".join((tok for tok in self.sheetRepr() if isinstance(tok, str)))
+		"""Returns the string without any styles"""
+		out = []
+		stack = [self]
+		while stack:
+			node = stack.pop()
+			if isinstance(node, RichStr):
+				stack.extend(reversed(node._subStrs))  # pylint: disable=protected-access
+			else:
+				out.append(str(node))
+		return "".join(out)
 
 	def getCSSStyle(self) -> str:
 		"""Returns the equivalent CSS style"""
@@ -664,9 +876,40 @@ class RichStr:
 	def join(self, els) -> "RichStr":
 		return rsjoin(self, els)
 
+	def _renderInto(self, outAppend: typing.Callable[[str], None]) -> bool:
+		"""Renders the whole string, including returning the styles to the initial state in the end, into ```outAppend```. Returns whether the result can be cached."""
+		initialState = _FrozenSheet({})
+		volatile = []
+		prevState = self._render({}, initialState, outAppend, volatile)
+		outAppend(_renderFrozenTransition(prevState, initialState, mergeCodes))
+		return not volatile
+
+	def _getCached(self) -> typing.Optional[str]:
+		cache = self._strCache
+		if cache is not None and cache[0] == _generation and cache[1] == mergeCodes:
+			return cache[2]
+		return None
+
 	def __str__(self) -> str:
-		buf = (str(it) for it in self.optimizedCodeRepr())
-		return "".join(buf)
+		res = self._getCached()
+		if res is not None:
+			return res
+
+		out = []
+		generation = _generation
+		cacheable = self._renderInto(out.append)
+		res = "".join(out)
+		if cacheable:
+			self._strCache = (generation, mergeCodes, res)
+		return res
+
+	def write(self, stream: typing.TextIO) -> None:
+		"""Writes the string into ```stream``` piece by piece, without building the whole string in memory. ```rs.write(sys.stdout)``` is the cheaper alternative to ```print(rs, end="")``` for large strings."""
+		res = self._getCached()
+		if res is not None:
+			stream.write(res)
+		else:
+			self._renderInto(stream.write)
 
 	def __repr__(self) -> str:
 		return self.__class__.__name__ + "(" + repr(self.sheetRepr()) + ")"
@@ -676,7 +919,9 @@ class RichStr:
 		buf = ["<span style='" + self.getCSSStyle() + "'>"]
 		for el in self.subStrs:
 			# pylint: disable=protected-access
-			if hasattr(el, "_repr_html_"):
+			if type(el) is str:  # pylint: disable=unidiomatic-typecheck
+				buf.append(el)  # plain strings are the most common case and have neither of the methods below
+			elif hasattr(el, "_repr_html_"):
 				buf.append(el._repr_html_())
 			elif hasattr(el, "toHTML"):
 				buf.append(el.toHTML())
@@ -686,21 +931,13 @@ class RichStr:
 		return "".join(buf)
 
 
-def interleavedChain(delim, *iters):
-	"""str.join for iterators """
-	iters = iter(iters)
-	yield next(iters)
-	for item in iters:
-		yield delim
-		yield item
-
-
 def rsjoin(delim: typing.Union[str, RichStr], itr: typing.Iterable[typing.Union[str, RichStr]], sheet: None = None) -> RichStr:
 	"""Joins (RichStr)ings into a (RichStr)ing"""
-	if delim:
-		substrs = list(interleavedChain(delim, *itr))
-	else:
-		substrs = list(itr)
+	substrs = list(itr)
+	if delim and len(substrs) > 1:
+		interleaved = [delim] * (2 * len(substrs) - 1)
+		interleaved[::2] = substrs
+		substrs = interleaved
 	return RichStr(*substrs, sheet=sheet)
 
 
@@ -714,52 +951,48 @@ if __name__ == "__main__":
 
 	thisLibName = os.path.splitext(os.path.basename(__file__))[0]
 
-	wordDelimiter = re.compile("([\\W]+)")
+	# A single pass of a single regex classifies each token: a paragraph break, a sentence delimiter, a word delimiter or a word
+	demoTokenRx = re.compile("(\n\n)|([\\.?!])|((?:(?!\n\n)[^\\w\\.?!])+)|(\\w+)")
+	PARAGRAPH, SENTENCE, DELIMITER, WORD = range(1, 5)
+
 	wordsStylers = itertools.cycle((groups.Back.red, groups.Back.green, groups.Back.blue))  # pylint: disable=no-member
 	#import random
 	#wordsStylers = itertools.cycle((random.choice(list(groups.Back.values())) for st in range(5)))  # pylint: disable=no-member
-
-	def decorateWords(sent):
-		"""Here we use styles as functors"""
-		i = 0
-		for token in wordDelimiter.split(sent):
-			if i % 2 == 0:
-				yield (next(wordsStylers))(token)
-			else:
-				yield token
-			i += 1
-
-	sentDelimiter = re.compile("([\\.?!])")
 	sentenceStyles = itertools.cycle((Sheet({"Fore": groups.Fore.black, "Blink": groups.Blink.slow}), Sheet({"Fore": groups.Fore.yellow})))
-
-	def decoratedSentences(par):
-		"""Here we create RichString from iterator over substrings"""
-		i = 0
-		st = next(sentenceStyles)
-		for token in sentDelimiter.split(par):
-			if i % 2 == 1:
-				st = next(sentenceStyles)
-				yield RichStr(*decorateWords(token), sheet=st)
-			else:
-				yield RichStr(*decorateWords(token), sheet=st)
-
-	def decorateSentences(par):
-		return rsjoin("", decoratedSentences(par))
-
 	paragraphDelimiter = "\n\n"
 	paragraphsStylers = itertools.cycle((groups.Back.lightblackEx, groups.Back.white))
 
 	def demo(text: str):
-		"""Returns a string with paragraphs formatted"""
-		return rsjoin(
-			paragraphDelimiter,
-			(
-				(next(paragraphsStylers))(
-					decorateSentences(par)
-				)
-				for par in text.split(paragraphDelimiter)
-			)
-		)
+		"""Returns a string with paragraphs formatted. Each paragraph gets its own sentence style, each word (including the empty ones around delimiters) its own background"""
+		paragraphs = []
+		words = []
+		expectWord = True  # a delimiter with no word before it still takes a word style, as splitting by delimiters would produce an empty word there
+		sentenceStyle = next(sentenceStyles)
+
+		for m in demoTokenRx.finditer(text):
+			kind = m.lastindex
+			token = m.group(kind)
+			if kind == WORD:
+				words.append((next(wordsStylers))(token))  # Here we use styles as functors
+				expectWord = False
+				continue
+
+			if expectWord:
+				next(wordsStylers)
+			if kind == PARAGRAPH:
+				paragraphs.append((next(paragraphsStylers))(RichStr(*words, sheet=sentenceStyle)))
+				words = []
+				sentenceStyle = next(sentenceStyles)
+			else:
+				if kind == SENTENCE:
+					next(wordsStylers), next(wordsStylers)  # the empty words around a sentence delimiter
+				words.append(token)
+			expectWord = True
+
+		if expectWord:
+			next(wordsStylers)
+		paragraphs.append((next(paragraphsStylers))(RichStr(*words, sheet=sentenceStyle)))
+		return rsjoin(paragraphDelimiter, paragraphs)
 
 	print(demo(thisLibName))
 	print(groups.Underline.underline(demo("https://gitlab.com/" + __author__ + "/" + thisLibName)))
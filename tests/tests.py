@@ -2,6 +2,7 @@
 import sys
 from pathlib import Path
 import unittest
+import io
 import itertools, re
 import colorama
 
@@ -58,6 +59,25 @@ class Tests(unittest.TestCase):
 			for i, testRStr in enumerate(case[:-1]):
 				self.assertEqual(str(testRStr), case[-1])
 
+	def testWrite(self):
+		"""tests writing a never rendered string into a stream, which should give the same result as str"""
+		for case in self.reference:
+			for testRStr in case[:-1]:
+				fresh = RichStr(testRStr)  # a new root has no cached rendering
+				stream = io.StringIO()
+				fresh.write(stream)
+				self.assertEqual(stream.getvalue(), case[-1])
+
+	def testWriteCached(self):
+		"""tests writing a string already rendered by str into a stream"""
+		for case in self.reference:
+			for testRStr in case[:-1]:
+				rendered = RichStr(testRStr)
+				self.assertEqual(str(rendered), case[-1])
+				stream = io.StringIO()
+				rendered.write(stream)
+				self.assertEqual(stream.getvalue(), case[-1])
+
 	def testPlain(self):
 		"""tests plaing method, which should return unstyled string"""
 		for case in self.reference:
@@ -78,6 +98,131 @@ class Tests(unittest.TestCase):
 		for perm in perms:
 			self.assertEqual([str(rs) for rs in (order[pos] for pos in perm)], [reference[pos] for pos in perm])
 
+	def testCacheInvalidation(self):
+		"""Test that the cached rendering follows the changes in the tree"""
+		child = RichStr("GGG", sheet=green)
+		parent = RichStr("RRR", child, sheet=red)
+		self.assertEqual(str(parent), "".join((colorama.Fore.RED, "RRR", colorama.Back.LIGHTGREEN_EX, "GGG", "\x1b[49;39m")))
+		child += "ggg"
+		self.assertEqual(str(parent), "".join((colorama.Fore.RED, "RRR", colorama.Back.LIGHTGREEN_EX, "GGGggg", "\x1b[49;39m")))
+		child.subStrs = ["ggg", "ggg"]
+		self.assertEqual(str(parent), "".join((colorama.Fore.RED, "RRR", colorama.Back.LIGHTGREEN_EX, "gggggg", "\x1b[49;39m")))
+
+		rs = RichStr("x", sheet=red)
+		self.assertEqual(str(rs), "".join((colorama.Fore.RED, "x", colorama.Fore.RESET)))
+		rs.sheet = Sheet(blue)
+		self.assertEqual(str(rs), "".join((colorama.Back.BLUE, "x", colorama.Back.RESET)))
+		rs.sheet["Fore"] = red
+		self.assertEqual(str(rs), "\x1b[44;31mx\x1b[49;39m")
+
+		leaf = ["a"]
+		rs = RichStr(leaf)
+		self.assertEqual(str(rs), "['a']")
+		leaf.append("b")
+		self.assertEqual(str(rs), "['a', 'b']")
+
+		color = BasicColor("yellow", 3)
+		rs = RichStr("x", sheet=color)
+		self.assertEqual(str(rs), "\x1b[33mx\x1b[39m")
+		color.intensive = True
+		self.assertEqual(str(rs), "\x1b[93mx\x1b[39m")
+
+
+class TestGroups(unittest.TestCase):
+	def testAddedGroupIsRendered(self):
+		"""Test that a group added after import takes part in rendering"""
+		groups["Extra"] = StyleGroup("Extra", [Style("ex", (7,))], Style("reset", (27,)))
+		try:
+			self.assertEqual(str(RichStr("x", sheet=groups.Extra.ex)), "\x1b[7mx\x1b[27m")
+			self.assertIn("Extra", Sheet(None))
+		finally:
+			del groups["Extra"]
+		self.assertNotIn("Extra", Sheet(None))
+
+	def testOtherStoragesDoNotAffectRendering(self):
+		"""Test that only the global groups are used for rendering"""
+		other = GroupsStorage({"Fore": groups.Fore})
+		other["Extra"] = StyleGroup("Extra", [Style("ex", (7,))], Style("reset", (27,)))
+		self.assertEqual(str(RichStr("x", sheet=red)), "\x1b[31mx\x1b[39m")
+		self.assertEqual(set(Sheet(None)), set(groups))
+
+	def testChangedResetIsRendered(self):
+		"""Test that changing the codes of a reset style affects the rendering"""
+		self.assertEqual(str(RichStr("b", sheet=red)), "\x1b[31mb\x1b[39m")
+		groups.Fore.reset.codes = (0,)
+		try:
+			self.assertEqual(str(RichStr("b", sheet=red)), "\x1b[31mb\x1b[0m")
+		finally:
+			groups.Fore.reset.codes = (39,)
+		self.assertEqual(str(RichStr("b", sheet=red)), "\x1b[31mb\x1b[39m")
+
+
+class TestControlCodes(unittest.TestCase):
+	def testRenderedCacheInvalidation(self):
+		"""Test that the cached escape sequence follows the changes of the codes"""
+		c = IndexedColor("IndexedRed", 1)
+		self.assertEqual(str(c), "\x1b[38;5;1m")
+		c.bg = True
+		self.assertEqual(str(c), "\x1b[48;5;1m")
+
+	def testInterning(self):
+		self.assertIs(ControlCodes((1, 2)), ControlCodes((1, 2)))
+		self.assertIs(ControlCodes(1), ControlCodes((1,)))
+		self.assertIsNot(Style("a", (1,)), Style("a", (1,)))
+
+	def testInternedAreImmutable(self):
+		a = ControlCodes((5,))
+		with self.assertRaises(AttributeError):
+			a.codes = (6,)
+		self.assertEqual(a.codes, (5,))
+		self.assertIs(ControlCodes((5,)), a)
+		s = Style("a", (5,))
+		s.codes = (6,)
+		self.assertEqual(str(s), "\x1b[6m")
+
+	def testColorConstruction(self):
+		self.assertEqual(BasicColor("red", 1).codes, (31,))
+		self.assertEqual(BasicColor("red", 1, intensive=True, bg=True).codes, (101,))
+		self.assertEqual(IndexedColor("IndexedRed", 1, bg=True).codes, (48, 5, 1))
+		self.assertEqual(RGBColor(None, 1, 2, 3).codes, (38, 2, 1, 2, 3))
+
+	def testColorComponentsSetters(self):
+		c = RGBColor(None, 1, 2, 3)
+		c.g = 0xFF
+		self.assertEqual(c.codes, (38, 2, 1, 0xFF, 3))
+		self.assertEqual(str(c), "\x1b[38;2;1;255;3m")
+
+	def testRGB2CSSHex(self):
+		self.assertEqual(RichConsole.RGB2CSSHex(0, 0xF, 0xFF), "#000fff")
+		for invalid in ((256, 0, 0), (-1, 0, 0)):
+			with self.assertRaises(ValueError):
+				RichConsole.RGB2CSSHex(*invalid)
+
+	def testColorFlagsSetters(self):
+		c = BasicColor("yellow", 3)
+		c.bg = True
+		c.intensive = True
+		self.assertEqual(c.codes, (103,))
+		self.assertTrue(c.bg and c.intensive)
+		c.bg = False
+		self.assertEqual(str(c), "\x1b[93m")
+
+
+class TestSheet(unittest.TestCase):
+	def testAccess(self):
+		s = Sheet([red, blue])
+		self.assertIs(s.Fore, red)
+		self.assertIs(s["Back"], blue)
+		with self.assertRaises(AttributeError):
+			s.Underline
+
+	def testMerge(self):
+		s = Sheet(red)
+		s += Sheet(blue)
+		self.assertIsInstance(s, Sheet)
+		self.assertEqual(s, Sheet([red, blue]))
+		self.assertEqual(Sheet(red) | Sheet(cyan), Sheet(cyan))
+
 
 class TestCodeMerger(unittest.TestCase):
 	def testCodeMerger1(self):
@@ -87,6 +232,12 @@ class TestCodeMerger(unittest.TestCase):
 		expected = ["1", red + blue, "2", green, "3", blue, "4", groups.Fore.reset + groups.Back.reset, "5"]
 		self.assertEqual(res, expected)
 
+	def testSingleCodePerTransition(self):
+		"""Test that all the groups changed in a transition are emitted as a single control sequence"""
+		res = RichStr("1", sheet=Sheet([red, blue])).optimizedCodeRepr()
+		self.assertEqual(res, [blue + red, "1", groups.Back.reset + groups.Fore.reset])
+		self.assertEqual(str(RichStr("1", sheet=Sheet([red, blue]))), "\x1b[44;31m1\x1b[49;39m")
+
 
 if __name__ == "__main__":
 	unittest.main()